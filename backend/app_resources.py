@@ -1,23 +1,78 @@
 import os
+import re
 import uuid
 import json
-import threading
+import shutil
+import functools
 import logging
+import threading
 from datetime import datetime
 from typing import Optional, List, Dict, Any
 
 from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, status, Body
-from sqlalchemy.orm import Session
-from sqlalchemy import func, or_
-from fastapi.responses import JSONResponse
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import func, or_, update, insert, literal_column, case
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from fastapi.responses import JSONResponse, FileResponse, Response
 from db import get_db
 from models import Upload, AnalysisJob, Report, LogEntry, User
 from pydantic import BaseModel
+import atexit
 import traceback
 import concurrent.futures
 
 
 AI_ANALYSIS_TIMEOUT_SECS = 80
+LOG_INSERT_BATCH_SIZE = 500
+MAX_PARSE_LINES = 1000
+AI_SAMPLE_LINES = 200
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+AI_CALL_TIMEOUT = 25  # seconds; tune as needed
+DASHBOARD_CACHE_TTL_SECS = int(os.environ.get("DASHBOARD_CACHE_TTL_SECS", "10"))
+DASHBOARD_CACHE_SIZE = 1024
+TEXT_UPLOAD_EXTENSIONS = (".log", ".txt", ".jsonl", ".json")
+# substring match, case-insensitive, one pass over the original text (no lowercased copies)
+ERROR_KEYWORD_RE = re.compile(r"error|exception", re.IGNORECASE)
+# /ai/query is synchronous; anything bigger belongs in /upload (background job)
+AI_QUERY_MAX_CHARS = int(os.environ.get("AI_QUERY_MAX_CHARS", str(64 * 1024)))
+
+# shared across jobs: bounds concurrent AI calls and avoids a thread spawn/join per job
+_AI_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+    max_workers=int(os.environ.get("AI_WORKERS", "4")),
+    thread_name_prefix="ai-call",
+)
+atexit.register(_AI_EXECUTOR.shutdown, wait=False)
+
+# background parse/analyse jobs; a burst of uploads queues here instead of spawning a thread each
+_JOB_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+    max_workers=int(os.environ.get("JOB_WORKERS", "4")),
+    thread_name_prefix="job",
+)
+atexit.register(_JOB_EXECUTOR.shutdown, wait=True)
+
+# CPU-bound line parsing runs in processes so concurrent jobs are not serialized by the GIL.
+# Created on first use (never at import, so a --preload master doesn't fork parse processes) and
+# sized to this worker's share of the cores: WEB_CONCURRENCY is the Gunicorn worker count.
+_WEB_WORKERS = max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS") or max(1, (os.cpu_count() or 1) // _WEB_WORKERS))
+_PARSE_POOL: Optional[concurrent.futures.ProcessPoolExecutor] = None
+_PARSE_POOL_LOCK = threading.Lock()
+
+def _get_parse_pool() -> concurrent.futures.ProcessPoolExecutor:
+    global _PARSE_POOL
+    with _PARSE_POOL_LOCK:
+        if _PARSE_POOL is None:
+            _PARSE_POOL = concurrent.futures.ProcessPoolExecutor(max_workers=PARSE_WORKERS)
+            atexit.register(_PARSE_POOL.shutdown, wait=False)
+        return _PARSE_POOL
+
+def _reset_parse_pool(pool: concurrent.futures.ProcessPoolExecutor):
+    # a broken pool stays broken; drop it so the next job builds a fresh one
+    global _PARSE_POOL
+    with _PARSE_POOL_LOCK:
+        if _PARSE_POOL is pool:
+            _PARSE_POOL = None
+    pool.shutdown(wait=False)
 
 
 # Attempt to import ai_integration if available (module local)
@@ -40,8 +95,65 @@ except Exception as e:
     AI_INTEGRATION_AVAILABLE = False
     logging.getLogger(__name__).warning("ai_integration not available or failed to import: %s", e)
 
+# short-lived per-user dashboard cache; dashboards poll, and the aggregates only move when a job finishes
+try:
+    from cachetools import TTLCache
+    _DASHBOARD_CACHE = TTLCache(maxsize=DASHBOARD_CACHE_SIZE, ttl=DASHBOARD_CACHE_TTL_SECS)
+except ImportError:
+    _DASHBOARD_CACHE = None
+_DASHBOARD_CACHE_LOCK = threading.Lock()
+
+def _invalidate_dashboard(user_email: Optional[str]):
+    if _DASHBOARD_CACHE is None or not user_email:
+        return
+    with _DASHBOARD_CACHE_LOCK:
+        _DASHBOARD_CACHE.pop(user_email, None)
+
+# orjson (C/SIMD) for the per-line parse loop and result files; stdlib json if it isn't installed
+try:
+    import orjson
+    _HAS_ORJSON = True
+except ImportError:
+    orjson = None
+    _HAS_ORJSON = False
+
+def _json_loads(s):
+    if _HAS_ORJSON:
+        return orjson.loads(s)
+    return json.loads(s)
+
+def _json_dumpb(obj) -> bytes:
+    if _HAS_ORJSON:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass  # e.g. non-str keys or >64-bit ints; stdlib handles those
+    return json.dumps(obj).encode("utf-8")
+
+def _json_dumps(obj) -> str:
+    return _json_dumpb(obj).decode("utf-8")
+
+# dateutil is only the slow-path fallback for non-ISO timestamps
+try:
+    from dateutil import parser as _dateutil_parser
+except ImportError:
+    _dateutil_parser = None
+
+def _parse_log_timestamp(timestamp_raw) -> Optional[datetime]:
+    ts_str = str(timestamp_raw)
+    try:
+        # fast path: ISO 8601, which nearly every structured logger emits
+        return datetime.fromisoformat(ts_str.replace("Z", "+00:00"))
+    except ValueError:
+        pass
+    if _dateutil_parser is None:
+        return None
+    try:
+        return _dateutil_parser.parse(ts_str)
+    except Exception:
+        return None
+
 UPLOAD_DIR = os.environ.get("UPLOAD_DIR", "data/uploads")
-os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 router = APIRouter(tags=["resources"])
 
@@ -101,7 +213,11 @@ class AnalyzeResponse(BaseModel):
 from db import SessionLocal  # for direct session in background threads
 
 RESULTS_DIR = os.path.join(UPLOAD_DIR, "results")
-os.makedirs(RESULTS_DIR, exist_ok=True)
+
+def init_storage():
+    """Create the upload and results directories. Called once from the app startup hook."""
+    # RESULTS_DIR lives under UPLOAD_DIR, so this creates both
+    os.makedirs(RESULTS_DIR, exist_ok=True)
 
 def _result_path_for_job(job_id: int) -> str:
     return os.path.join(RESULTS_DIR, f"job-{job_id}.json")
@@ -109,29 +225,161 @@ def _result_path_for_job(job_id: int) -> str:
 def save_job_result_to_file(job_id: int, payload: dict):
     p = _result_path_for_job(job_id)
     try:
-        with open(p, "w", encoding="utf-8") as fh:
-            json.dump(payload, fh)
+        with open(p, "wb") as fh:
+            fh.write(_json_dumpb(payload))
     except Exception:
         logging.exception("Failed to save job result to file for job %s", job_id)
 
+@functools.lru_cache(maxsize=128)
+def _cached_load(path: str, mtime_ns: int, size: int) -> dict:
+    # keyed on (mtime, size) so a rewritten file is re-read; callers must not mutate the result
+    with open(path, "rb") as fh:
+        return _json_loads(fh.read())
+
+def _read_result_file(path: str) -> dict:
+    st = os.stat(path)
+    return _cached_load(path, st.st_mtime_ns, st.st_size)
+
+@functools.lru_cache(maxsize=128)
+def _cached_result_bytes(path: str, mtime_ns: int, size: int) -> bytes:
+    with open(path, "rb") as fh:
+        return fh.read()
+
+def _read_result_bytes(path: str) -> bytes:
+    # the file is already JSON written by save_job_result_to_file: serve it without parse/re-encode
+    st = os.stat(path)
+    return _cached_result_bytes(path, st.st_mtime_ns, st.st_size)
+
 def load_job_result_from_file(job_id: int) -> Optional[dict]:
     p = _result_path_for_job(job_id)
     if not os.path.exists(p):
         return None
     try:
-        with open(p, "r", encoding="utf-8") as fh:
-            return json.load(fh)
+        return _read_result_file(p)
     except Exception:
         logging.exception("Failed to read job result file for job %s", job_id)
         return None
 
+def bulk_insert_log_entries(db: Session, rows: List[Dict[str, Any]], chunk: int = LOG_INSERT_BATCH_SIZE) -> None:
+    """Core executemany INSERT of LogEntry dicts in chunks; no ORM unit of work, no commit."""
+    for start in range(0, len(rows), chunk):
+        db.execute(insert(LogEntry), rows[start:start + chunk])
+
+def _flush_log_entries(db: Session, pending: List[Dict[str, Any]], user_email: str) -> int:
+    """
+    Bulk-insert the pending LogEntry dicts in one statement, bump the owner's User.log_count
+    in the same transaction, commit, and clear the buffer.
+    Returns how many rows were actually stored (0 if the batch was rolled back); callers
+    compare it with the batch size and record dropped rows on the job.
+    """
+    if not pending:
+        return 0
+    inserted = 0
+    # one timestamp per batch instead of a datetime.utcnow() column-default call per row
+    batch_created_at = datetime.utcnow()
+    for row in pending:
+        row.setdefault("created_at", batch_created_at)
+    try:
+        bulk_insert_log_entries(db, pending)
+        db.execute(
+            update(User).where(User.email == user_email).values(log_count=User.log_count + len(pending))
+        )
+        db.commit()
+        inserted = len(pending)
+    except Exception:
+        db.rollback()
+        logging.getLogger(__name__).exception("Bulk insert of %d log entries failed", len(pending))
+    pending.clear()
+    return inserted
+
+def _set_job_progress(db: Session, job_id: int, progress: int):
+    try:
+        db.execute(update(AnalysisJob).where(AnalysisJob.id == job_id).values(progress=progress))
+        db.commit()
+    except Exception:
+        db.rollback()
+
+def parse_log_file(filepath: str):
+    """
+    Parse up to MAX_PARSE_LINES non-blank lines of an uploaded file without touching the DB.
+    Returns (rows, sample_lines, errors_count); rows are LogEntry mappings minus user/upload ids.
+    Kept at module level so it can run in _PARSE_POOL.
+    """
+    rows: List[Dict[str, Any]] = []
+    sample_lines: List[str] = []
+    errors_count = 0
+    # binary mode: no incremental text decoder per line, and the JSON parser takes bytes as-is
+    with open(filepath, "rb") as fh:
+        for line in fh:
+            # collect the AI sample in the same pass (raw lines, blanks included)
+            if len(sample_lines) < AI_SAMPLE_LINES:
+                sample_lines.append(line.rstrip(b"\r\n").decode("utf-8", "ignore"))
+
+            # keep an upper bound to avoid huge immediate inserts
+            if len(rows) >= MAX_PARSE_LINES:
+                break
+
+            line_stripped = line.strip()
+            if not line_stripped:
+                continue
+            # raw is stored as text anyway; decode once and reuse it for the non-JSON message
+            line_text = line_stripped.decode("utf-8", "ignore")
+
+            # parse JSON if possible
+            parsed_json = None
+            try:
+                parsed_json = _json_loads(line_stripped)
+            except Exception:
+                parsed_json = None
+
+            timestamp = None
+            level = None
+            service = None
+            message = None
+            if isinstance(parsed_json, dict):
+                timestamp_raw = parsed_json.get("timestamp") or parsed_json.get("time") or parsed_json.get("@timestamp")
+                if timestamp_raw:
+                    timestamp = _parse_log_timestamp(timestamp_raw)
+                level = parsed_json.get("level") or parsed_json.get("severity")
+                service = parsed_json.get("service") or parsed_json.get("name")
+                message = parsed_json.get("message") or parsed_json.get("msg") or _json_dumps(parsed_json)
+            else:
+                message = line_text
+
+            # simple error detection
+            if level and isinstance(level, str) and level.lower().startswith("err"):
+                errors_count += 1
+            elif "error" in (message or "").lower():
+                errors_count += 1
+
+            # same rule the dashboard used to evaluate with LIKEs, now stored per row
+            msg_lower = (message or "").lower()
+            is_error = bool(
+                (isinstance(level, str) and level.strip().lower().startswith("err"))
+                or "error" in msg_lower
+                or "exception" in msg_lower
+                or "traceback" in msg_lower
+            )
+
+            rows.append({
+                "timestamp": timestamp,
+                "level": str(level).strip().upper() if level else None,
+                "service": service,
+                "message": (message[:4000] if message else None),
+                "raw": line_text[:8000],
+                "is_error": is_error,
+            })
+    return rows, sample_lines, errors_count
+
 def process_job_in_thread(job_id: int):
     db = SessionLocal()
+    job_user_email = None
     try:
         job: AnalysisJob = db.query(AnalysisJob).filter(AnalysisJob.id == job_id).first()
         if not job:
             logging.getLogger(__name__).warning("process_job_in_thread: job not found %s", job_id)
             return
+        job_user_email = job.user_email
 
         logging.getLogger(__name__).info("process_job_in_thread: starting job_id=%s upload_id=%s user=%s", job.id, job.upload_id, job.user_email)
 
@@ -154,123 +402,73 @@ def process_job_in_thread(job_id: int):
 
         # initial counters
         parsed = 0
+        dropped = 0
         errors_count = 0
 
-        # try reading total lines for progress (best-effort)
-        try:
-            with open(filepath, "r", encoding="utf-8", errors="ignore") as fh:
-                total_lines = sum(1 for _ in fh)
-        except Exception as e:
+        if not os.path.isfile(filepath):
             job.status = "failed"
-            job.error = f"Failed to read upload file: {e}"
+            job.error = f"Failed to read upload file: {filepath} not found"
             job.finished_at = datetime.utcnow()
             db.commit()
-            logging.getLogger(__name__).exception("process_job_in_thread: cannot read file %s: %s", filepath, e)
+            logging.getLogger(__name__).error("process_job_in_thread: cannot read file %s", filepath)
             return
 
-        processed = 0
+        sample_lines: List[str] = []
         try:
-            with open(filepath, "r", encoding="utf-8", errors="ignore") as fh:
-                for line in fh:
-                    # keep an upper bound to avoid huge immediate inserts
-                    if processed >= 1000:
-                        break
-
-                    line_stripped = line.strip()
-                    if not line_stripped:
-                        continue
-
-                    # parse JSON if possible
-                    parsed_json = None
-                    try:
-                        parsed_json = json.loads(line_stripped)
-                    except Exception:
-                        parsed_json = None
-
-                    timestamp = None
-                    level = None
-                    service = None
-                    message = None
-                    if isinstance(parsed_json, dict):
-                        timestamp_raw = parsed_json.get("timestamp") or parsed_json.get("time") or parsed_json.get("@timestamp")
-                        if timestamp_raw:
-                            try:
-                                timestamp = datetime.fromisoformat(str(timestamp_raw).replace("Z", "+00:00"))
-                            except Exception:
-                                timestamp = None
-                        level = parsed_json.get("level") or parsed_json.get("severity")
-                        service = parsed_json.get("service") or parsed_json.get("name")
-                        message = parsed_json.get("message") or parsed_json.get("msg") or json.dumps(parsed_json)
-                    else:
-                        message = line_stripped
-
-                    # simple error detection
-                    if level and isinstance(level, str) and level.lower().startswith("err"):
-                        errors_count += 1
-                    elif "error" in (message or "").lower():
-                        errors_count += 1
-
-                    # ---------- DEDUPE CHECK (simple, safe) ----------
-                    raw_trunc = line_stripped[:8000]
-
-                    try:
-                        exists = db.query(LogEntry).filter(
-                            LogEntry.upload_id == upload.id,
-                            LogEntry.user_email == job.user_email,
-                            LogEntry.raw == raw_trunc
-                        ).first()
-                    except Exception as e:
-                        logging.getLogger(__name__).exception("process_job_in_thread: dedupe select failed: %s", e)
-                        exists = None
-
-                    if exists:
-                        # already present -> skip insertion
-                        processed += 1
-                        # keep parsed as unique lines count; do not increment parsed here
-                        # update progress occasionally
-                        if processed % 50 == 0:
-                            try:
-                                job.progress = min(90, int((processed / max(1, total_lines)) * 80) + 10)
-                                db.commit()
-                            except Exception:
-                                db.rollback()
-                        continue
-
-                    # ---------- INSERT (only when not duplicate) ----------
-                    le = LogEntry(
-                        user_email=job.user_email,
-                        upload_id=upload.id,
-                        timestamp=timestamp,
-                        level=(level or "").upper() if level else None,
-                        service=service,
-                        message=(message[:4000] if message else None),
-                        raw=raw_trunc,
-                    )
-                    db.add(le)
-                    parsed += 1
-                    processed += 1
-
-                    # commit in batches to avoid long transactions and update progress
-                    if processed % 50 == 0:
-                        try:
-                            db.commit()
-                        except Exception:
-                            db.rollback()
-                        try:
-                            job.progress = min(90, int((processed / max(1, total_lines)) * 80) + 10)
-                            db.commit()
-                        except Exception:
-                            db.rollback()
-
-            # final commit after loop
+            # CPU-bound part (JSON decode + field extraction) runs in a worker process
+            pool = _get_parse_pool()
             try:
-                db.commit()
-            except Exception:
-                db.rollback()
+                rows, sample_lines, errors_count = pool.submit(parse_log_file, filepath).result()
+            except (RuntimeError, concurrent.futures.process.BrokenProcessPool) as e:
+                logging.getLogger(__name__).warning("process_job_in_thread: parse pool unavailable (%s); parsing inline", e)
+                if isinstance(e, concurrent.futures.process.BrokenProcessPool):
+                    _reset_parse_pool(pool)
+                rows, sample_lines, errors_count = parse_log_file(filepath)
+            _set_job_progress(db, job.id, 40)
+
+            # one SELECT for everything already stored for this upload; dedupe is then an O(1) set lookup
+            try:
+                existing = {
+                    r[0] for r in db.query(LogEntry.raw).filter(
+                        LogEntry.upload_id == upload.id,
+                        LogEntry.user_email == job.user_email
+                    ).all()
+                }
+            except Exception as e:
+                logging.getLogger(__name__).exception("process_job_in_thread: dedupe preload failed: %s", e)
+                existing = set()
+
+            # DB phase stays in this thread: dedupe, then bulk-insert in batches
+            pending: List[Dict[str, Any]] = []
+            for i, row in enumerate(rows, 1):
+                if row["raw"] in existing:
+                    continue
+                existing.add(row["raw"])
+                row["user_email"] = job.user_email
+                row["upload_id"] = upload.id
+                pending.append(row)
+                if len(pending) >= LOG_INSERT_BATCH_SIZE:
+                    batch = len(pending)
+                    stored = _flush_log_entries(db, pending, job.user_email)
+                    parsed += stored
+                    dropped += batch - stored
+                    _set_job_progress(db, job.id, min(90, 40 + int((i / len(rows)) * 50)))
+            batch = len(pending)
+            stored = _flush_log_entries(db, pending, job.user_email)
+            parsed += stored
+            dropped += batch - stored
 
         except Exception as e:
             logging.getLogger(__name__).exception("process_job_in_thread: parsing loop failed: %s", e)
-            # continue - we'll still attempt AI/fallback and finalize job
+            # continue - we'll still attempt AI/fallback and finalize job, but say the data is incomplete
+            db.rollback()
+            job.error = f"log parsing stopped early: {e}"
+            db.commit()
+
+        if dropped:
+            # the job still finishes "done" with what was stored; job.error tells the user it's partial
+            job.error = f"{dropped} log lines could not be stored (database error); results are partial"
+            db.commit()
 
         logging.getLogger(__name__).info("process_job_in_thread: finished parsing (unique_parsed=%d approximate_errors=%d)", parsed, errors_count)
 
@@ -282,33 +480,22 @@ def process_job_in_thread(job_id: int):
         except Exception:
             db.rollback()
 
-        # --- Prepare a small sample for AI (first ~200 lines) ---
-        sample_lines = []
-        try:
-            with open(filepath, "r", encoding="utf-8", errors="ignore") as fh:
-                for i, raw_line in enumerate(fh):
-                    if i >= 200:
-                        break
-                    sample_lines.append(raw_line.rstrip("\n"))
-        except Exception:
-            sample_lines = []
+        # --- Small sample for AI (first ~200 lines, collected during the parse pass) ---
         txt_sample = "\n".join(sample_lines)
 
         # --- Run AI with a short per-call timeout; if it fails, run fallback ---
         ai_result = None
         ai_error = None
         if AI_INTEGRATION_AVAILABLE and analyze_log_text:
-            AI_CALL_TIMEOUT = 25  # seconds; tune as needed
-            with concurrent.futures.ThreadPoolExecutor(max_workers=1) as ex:
-                fut = ex.submit(lambda: analyze_log_text(txt_sample, filename=upload.filename))
-                try:
-                    ai_result = fut.result(timeout=AI_CALL_TIMEOUT)
-                except concurrent.futures.TimeoutError:
-                    ai_error = f"AI call timed out after {AI_CALL_TIMEOUT}s"
-                    logging.getLogger(__name__).warning("process_job_in_thread: ai call timed out for job %s", job.id)
-                except Exception as e:
-                    logging.getLogger(__name__).exception("process_job_in_thread: AI call raised: %s", e)
-                    ai_error = str(e)
+            fut = _AI_EXECUTOR.submit(analyze_log_text, txt_sample, filename=upload.filename, owner=job.user_email)
+            try:
+                ai_result = fut.result(timeout=AI_CALL_TIMEOUT)
+            except concurrent.futures.TimeoutError:
+                ai_error = f"AI call timed out after {AI_CALL_TIMEOUT}s"
+                logging.getLogger(__name__).warning("process_job_in_thread: ai call timed out for job %s", job.id)
+            except Exception as e:
+                logging.getLogger(__name__).exception("process_job_in_thread: AI call raised: %s", e)
+                ai_error = str(e)
 
         # If AI didn't return dict, use heuristic fallback (so UI always gets something)
         final_result = None
@@ -355,6 +542,8 @@ def process_job_in_thread(job_id: int):
                 f"Parsed {parsed} unique lines from file {upload.filename}.",
                 f"Detected ~{errors_count} error-like messages.",
             ]
+            if job.error:
+                summary_parts.append(f"Warning: {job.error}.")
             summary = "\n".join(summary_parts)
             report = Report(job_id=job.id, user_email=job.user_email, title=f"Report for {upload.filename}", summary=summary)
             db.add(report)
@@ -376,11 +565,14 @@ def process_job_in_thread(job_id: int):
             pass
     finally:
         db.close()
+        # new log rows / job status / report: drop the cached dashboard for this user
+        _invalidate_dashboard(job_user_email)
 
 
-def enqueue_job(job_id: int):
-    t = threading.Thread(target=process_job_in_thread, args=(job_id,), daemon=True)
-    t.start()
+def enqueue_job(job_id: int, user_email: Optional[str] = None):
+    # a queued job changes active_uploads right away
+    _invalidate_dashboard(user_email)
+    _JOB_EXECUTOR.submit(process_job_in_thread, job_id)
 
 
 # -------------------------
@@ -408,43 +600,42 @@ def get_dashboard(current_user: User = Depends(get_current_active_user), db: Ses
 
     logger = logging.getLogger(__name__)
 
-    # total_logs (simple, defensive)
+    if _DASHBOARD_CACHE is not None:
+        with _DASHBOARD_CACHE_LOCK:
+            cached = _DASHBOARD_CACHE.get(user_email)
+        if cached is not None:
+            return cached
+
+    # total_logs: counter maintained on insert/delete, so no COUNT(*) over log_entries
     try:
-        total_logs = db.query(func.count()).select_from(LogEntry).filter(LogEntry.user_email == user_email).scalar() or 0
+        total_logs = db.query(User.log_count).filter(User.email == user_email).scalar() or 0
     except Exception:
         logger.exception("Counting total_logs failed")
         total_logs = 0
 
-    # ---- errors: robust detection using level OR message keywords ----
+    # ---- errors: precomputed is_error flag, served by ix_logentry_user_err ----
     errors = 0
     try:
-        # normalize level and message: trim + lower + coalesce to avoid NULLs
-        lvl_expr = func.lower(func.trim(func.coalesce(LogEntry.level, "")))
-        msg_expr = func.lower(func.coalesce(LogEntry.message, ""))
-
-        # level starts with 'err' (covers "ERR", "ERROR", "Err:", "ERROR: ...")
-        cond_level = lvl_expr.like("err%")
-        # message contains common error words (covers logs without level)
-        cond_msg = or_(
-            msg_expr.like("%error%"),
-            msg_expr.like("%exception%"),
-            msg_expr.like("%traceback%")
-        )
-
-        # count distinct ids so rows matching both aren't double-counted
-        errors = (
-            db.query(func.count(func.distinct(LogEntry.id)))
-            .filter(LogEntry.user_email == user_email)
-            .filter(or_(cond_level, cond_msg))
-            .scalar() or 0
-        )
+        errors = db.query(func.count()).select_from(LogEntry).filter(
+            LogEntry.user_email == user_email,
+            LogEntry.is_error == True  # noqa: E712
+        ).scalar() or 0
     except Exception:
-        # fallback: simpler prefix match on trimmed uppercase level
+        # fallback (e.g. column not migrated yet): level OR message keywords
+        logger.exception("Counting errors via is_error failed; falling back to LIKE scan")
+        db.rollback()
         try:
-            errors = db.query(func.count()).select_from(LogEntry).filter(
-                LogEntry.user_email == user_email,
-                func.upper(func.coalesce(func.trim(LogEntry.level), "")) .like("ERROR%")
-            ).scalar() or 0
+            errors = (
+                db.query(func.count(func.distinct(LogEntry.id)))
+                .filter(LogEntry.user_email == user_email)
+                .filter(or_(
+                    LogEntry.level.like("ERR%"),
+                    LogEntry.message.ilike("%error%"),
+                    LogEntry.message.ilike("%exception%"),
+                    LogEntry.message.ilike("%traceback%")
+                ))
+                .scalar() or 0
+            )
         except Exception:
             logger.exception("Counting errors failed (fallback)")
             errors = 0
@@ -454,7 +645,8 @@ def get_dashboard(current_user: User = Depends(get_current_active_user), db: Ses
     try:
         active_uploads = db.query(func.count()).select_from(AnalysisJob).filter(
             AnalysisJob.user_email == user_email,
-            func.lower(func.coalesce(AnalysisJob.status, "")) .in_(["queued", "running"])
+            # status is only ever written lowercase by this module; a bare IN can use ix_analysis_jobs_user_status
+            AnalysisJob.status.in_(["queued", "running"])
         ).scalar() or 0
     except Exception:
         try:
@@ -501,13 +693,17 @@ def get_dashboard(current_user: User = Depends(get_current_active_user), db: Ses
         user_email, total_logs, errors, active_uploads, len(recent_reports), bool(last_upload)
     )
 
-    return DashboardResponse(
+    resp = DashboardResponse(
         total_logs=total_logs,
         errors=errors,
         active_uploads=active_uploads,
         recent_reports=recent_reports,
         last_upload=last_upload,
     )
+    if _DASHBOARD_CACHE is not None:
+        with _DASHBOARD_CACHE_LOCK:
+            _DASHBOARD_CACHE[user_email] = resp
+    return resp
 
 
     
@@ -522,25 +718,26 @@ def upload_file(file: UploadFile = File(...), current_user: User = Depends(get_c
     unique_name = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}-{filename}"
     path = os.path.join(UPLOAD_DIR, unique_name)
     try:
+        # stream to disk in fixed-size chunks so memory stays bounded regardless of upload size
         with open(path, "wb") as fh:
-            contents = file.file.read()
-            fh.write(contents)
-            size = len(contents)
+            shutil.copyfileobj(file.file, fh, length=UPLOAD_CHUNK_SIZE)
+            size = fh.tell()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to save file: {e}")
 
+    # upload + job in one transaction; flush() assigns ids without a commit/refresh round trip each
     upload = Upload(user_email=current_user.email, filename=filename, storage_path=path, size=size)
     db.add(upload)
-    db.commit()
-    db.refresh(upload)
-
+    db.flush()
     job = AnalysisJob(upload_id=upload.id, user_email=current_user.email, status="queued", progress=0)
     db.add(job)
+    db.flush()
+    upload_id, job_id, job_status = upload.id, job.id, job.status
     db.commit()
-    db.refresh(job)
 
-    enqueue_job(job.id)
-    return UploadResponse(upload_id=upload.id, job_id=job.id, status=job.status)
+    # enqueue only after commit so the worker's session can see the job row
+    enqueue_job(job_id, current_user.email)
+    return UploadResponse(upload_id=upload_id, job_id=job_id, status=job_status)
 
 @router.get("/uploads")
 def list_uploads(current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
@@ -550,6 +747,20 @@ def list_uploads(current_user: User = Depends(get_current_active_user), db: Sess
         out.append({"id": u.id, "name": u.filename, "created_at": u.created_at.isoformat() if u.created_at else None, "size": u.size, "parsed_count": u.parsed_count})
     return out
 
+@router.get("/uploads/{upload_id}/file")
+def serve_upload_file(upload_id: int, current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    u = db.query(Upload).filter(Upload.id == upload_id, Upload.user_email == current_user.email).first()
+    if not u or not u.storage_path:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    # one stat for both the 404 check and FileResponse (which would otherwise stat again)
+    try:
+        st = os.stat(u.storage_path)
+    except OSError:
+        raise HTTPException(status_code=404, detail="Upload file missing on disk")
+    filename = u.filename or os.path.basename(u.storage_path)
+    media_type = "text/plain" if filename.lower().endswith(TEXT_UPLOAD_EXTENSIONS) else "application/octet-stream"
+    return FileResponse(u.storage_path, media_type=media_type, filename=filename, stat_result=st)
+
 @router.get("/files/last")
 def get_last_file(current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
     logging.getLogger(__name__).info("GET /files/last requested by user=%s", getattr(current_user, "email", None))
@@ -560,9 +771,36 @@ def get_last_file(current_user: User = Depends(get_current_active_user), db: Ses
     logging.getLogger(__name__).info("Found last upload id=%s name=%s for user=%s", u.id, u.filename, getattr(current_user, "email", None))
     return {"file_id": u.id, "name": u.filename, "created_at": u.created_at.isoformat() if u.created_at else None, "size": u.size, "parsed_count": u.parsed_count}
 
+@router.get("/jobs")
+def list_jobs(current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    # selectinload: one extra IN query for all uploads instead of a lazy load per job
+    q = (
+        db.query(AnalysisJob)
+        .options(selectinload(AnalysisJob.upload))
+        .filter(AnalysisJob.user_email == current_user.email)
+        .order_by(AnalysisJob.created_at.desc())
+        .all()
+    )
+    out = []
+    for j in q:
+        out.append({
+            "job_id": j.id,
+            "status": j.status,
+            "progress": j.progress,
+            "upload_id": j.upload_id,
+            "file_name": j.upload.filename if j.upload else None,
+            "created_at": j.created_at.isoformat() if j.created_at else None,
+            "finished_at": j.finished_at.isoformat() if j.finished_at else None,
+        })
+    return out
+
 @router.get("/analysis/{job_id}", response_model=JobStatusResponse)
+@router.get("/jobs/{job_id}", response_model=JobStatusResponse)
 def get_job_status(job_id: int, current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
-    job = db.query(AnalysisJob).filter(AnalysisJob.id == job_id, AnalysisJob.user_email == current_user.email).first()
+    # polled by the frontend while the job runs on _JOB_EXECUTOR; read only the status columns
+    job = db.query(AnalysisJob).with_entities(
+        AnalysisJob.id, AnalysisJob.status, AnalysisJob.progress, AnalysisJob.error, AnalysisJob.finished_at
+    ).filter(AnalysisJob.id == job_id, AnalysisJob.user_email == current_user.email).first()
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     return JobStatusResponse(job_id=job.id, status=job.status, progress=job.progress, error=job.error, finished_at=job.finished_at)
@@ -599,36 +837,56 @@ def get_logs(
         lvl = level.strip().upper()
         # allow exact or prefix matches like "ERROR", "ERR", "ERROR:Something"
         try:
-            query = query.filter(func.upper(func.coalesce(LogEntry.level, "")).like(f"{lvl}%"))
+            # level is stored trimmed + uppercased, so a bare prefix LIKE can use ix_logentry_user_level
+            query = query.filter(LogEntry.level.like(f"{lvl}%"))
         except Exception:
             # fallback to safer equality if DB backend doesn't support LIKE in this context
-            query = query.filter(func.upper(func.coalesce(LogEntry.level, "")) == lvl)
+            query = query.filter(LogEntry.level == lvl)
 
 
     if q and q.strip() != "":
-        likepat = f"%{q.strip().lower()}%"
-        query = query.filter(
-            or_(
-                func.lower(func.coalesce(LogEntry.message, "")) .like(likepat),
-                func.lower(func.coalesce(LogEntry.service, "")) .like(likepat),
-                func.lower(func.coalesce(LogEntry.raw, "")) .like(likepat),
+        if db.get_bind().dialect.name == "postgresql":
+            # tokenized match on the GIN-indexed generated column (see migrations._add_log_entry_search_vec)
+            query = query.filter(
+                literal_column("log_entries.search_vec").op("@@")(func.plainto_tsquery("simple", q.strip()))
+            )
+        else:
+            likepat = f"%{q.strip().lower()}%"
+            query = query.filter(
+                or_(
+                    func.lower(func.coalesce(LogEntry.message, "")) .like(likepat),
+                    func.lower(func.coalesce(LogEntry.service, "")) .like(likepat),
+                    func.lower(func.coalesce(LogEntry.raw, "")) .like(likepat),
+                )
             )
-        )
 
-    rows = query.order_by(LogEntry.created_at.desc()).limit(limit).all()
+    # plain column tuples: no ORM identity-map / attribute loading for up to 10k rows
+    rows = (
+        query.with_entities(
+            LogEntry.id,
+            LogEntry.timestamp,
+            LogEntry.level,
+            LogEntry.service,
+            LogEntry.message,
+            LogEntry.upload_id,
+        )
+        # rows in an insert batch share created_at; id keeps the order stable within it
+        .order_by(LogEntry.created_at.desc(), LogEntry.id.desc())
+        .limit(limit)
+        .all()
+    )
 
-    out = []
-    for l in rows:
-        out.append(
-            LogEntryResponse(
-                id=l.id,
-                timestamp=l.timestamp,
-                level=l.level,
-                service=l.service,
-                message=(l.message[:1000] if l.message else None),
-                upload_id=l.upload_id 
-            )
+    out = [
+        LogEntryResponse(
+            id=r.id,
+            timestamp=r.timestamp,
+            level=r.level,
+            service=r.service,
+            message=(r.message[:1000] if r.message else None),
+            upload_id=r.upload_id
         )
+        for r in rows
+    ]
     return out
 
 @router.get("/reports", response_model=List[ReportResponse])
@@ -643,14 +901,24 @@ def get_report(report_id: int, current_user: User = Depends(get_current_active_u
         raise HTTPException(status_code=404, detail="Report not found")
     return ReportResponse(id=r.id, title=r.title, summary=r.summary, created_at=r.created_at)
 
+# the mapped table never changes at runtime, so compute these once
+_USER_COLUMNS = frozenset(c.name for c in User.__table__.columns) if hasattr(User, "__table__") else frozenset()
+# identity, credential, activation and verification columns are never client-writable
+# (role is the free-text job title picked at signup, not a permission, so it stays editable)
+_PROTECTED_PROFILE_FIELDS = frozenset({
+    "id", "email", "password", "hashed_password", "created_at", "updated_at", "log_count",
+    "is_active", "is_verified", "verified_at", "firebase_uid",
+})
+# PATCH /profile echoes every user column except the password hash
+_PROFILE_RESPONSE_COLUMNS = tuple(c for c in User.__table__.columns if c.name != "hashed_password")
+
 @router.patch("/profile", response_model=dict)
 def update_profile(payload: dict, current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
     if not payload or not isinstance(payload, dict) or len(payload) == 0:
         raise HTTPException(status_code=400, detail="Nothing to update")
 
-    PROTECTED = {"id", "email", "password", "created_at", "updated_at"}
-
-    user_columns = set([c.name for c in User.__table__.columns]) if hasattr(User, "__table__") else set()
+    PROTECTED = _PROTECTED_PROFILE_FIELDS
+    user_columns = _USER_COLUMNS
     updates = {}
     for key, value in payload.items():
         if key in PROTECTED:
@@ -668,25 +936,20 @@ def update_profile(payload: dict, current_user: User = Depends(get_current_activ
     if not updates:
         raise HTTPException(status_code=400, detail="No valid profile fields to update")
 
-    u = db.query(User).filter(User.id == current_user.id).first()
-    if not u:
+    # keys are whitelisted against the table above, so a single UPDATE (no load, no attribute events);
+    # RETURNING hands back the new row in the same round trip where the dialect supports it
+    stmt = update(User).where(User.id == current_user.id).values(updates)
+    if db.get_bind().dialect.update_returning:
+        row = db.execute(stmt.returning(*_PROFILE_RESPONSE_COLUMNS)).first()
+    else:
+        row = None
+        if db.execute(stmt).rowcount:
+            row = db.query(*_PROFILE_RESPONSE_COLUMNS).filter(User.id == current_user.id).first()
+    if row is None:
+        db.rollback()
         raise HTTPException(status_code=404, detail="User not found")
-
-    for k, v in updates.items():
-        try:
-            setattr(u, k, v)
-        except Exception as e:
-            logging.getLogger(__name__).warning("Skipping update for %s: %s", k, e)
-
     db.commit()
-    db.refresh(u)
-
-    out = {}
-    for col in user_columns:
-        if col in {"password"}:
-            continue
-        out[col] = getattr(u, col)
-    return out
+    return dict(row._mapping)
 
 @router.delete("/uploads/{upload_id}")
 def delete_upload(
@@ -695,17 +958,12 @@ def delete_upload(
     db: Session = Depends(get_db),
 ):
     """
-    Robust delete handler:
-      - deletes Report rows that reference AnalysisJob(s) for this upload
-      - deletes AnalysisJob rows for this upload
-      - deletes LogEntry rows for this upload
-      - removes file from disk (best-effort)
-      - deletes Upload row
+    Delete an upload: its jobs, their reports and its log entries go with it via
+    ON DELETE CASCADE. The file on disk is removed best-effort.
     Returns JSONResponse with helpful error messages.
     """
     logger = logging.getLogger(__name__)
 
-    # 1) find the upload, ensure ownership
     upload = db.query(Upload).filter(
         Upload.id == upload_id,
         Upload.user_email == current_user.email
@@ -714,80 +972,35 @@ def delete_upload(
         return JSONResponse(status_code=404, content={"detail": "Upload not found"})
 
     try:
-        # 2) Find analysis job ids associated with this upload (if any)
-        job_rows = db.query(AnalysisJob.id).filter(
-            AnalysisJob.upload_id == upload_id,
-            AnalysisJob.user_email == current_user.email
-        ).all()
-        job_ids = [r[0] for r in job_rows] if job_rows else []
-
-        # 3) Delete Reports that reference those jobs (must happen before deleting jobs)
-        if job_ids:
-            try:
-                db.query(Report).filter(Report.job_id.in_(job_ids)).delete(synchronize_session=False)
-                db.commit()
-            except SQLAlchemyError:
-                db.rollback()
-                logger.exception("Failed to delete Reports referencing jobs %s for upload %s", job_ids, upload_id)
-                # continue - we will attempt to delete jobs/logs/upload but inform user below if needed
-
-        # 4) Delete AnalysisJob rows for this upload
-        try:
-            db.query(AnalysisJob).filter(
-                AnalysisJob.upload_id == upload_id,
-                AnalysisJob.user_email == current_user.email
-            ).delete(synchronize_session=False)
-            db.commit()
-        except SQLAlchemyError as se:
-            db.rollback()
-            logger.exception("Failed to delete AnalysisJob rows for upload %s: %s", upload_id, se)
-            return JSONResponse(status_code=500, content={"detail": "Failed to delete analysis jobs", "error": str(se)})
-
-        # 5) Delete LogEntry rows associated with the upload
-        try:
-            db.query(LogEntry).filter(
-                LogEntry.upload_id == upload_id,
-                LogEntry.user_email == current_user.email
-            ).delete(synchronize_session=False)
-            db.commit()
-        except SQLAlchemyError:
-            db.rollback()
-            logger.exception("Failed to delete LogEntry rows for upload %s", upload_id)
-            # continue - we still attempt to remove upload record & file
-
-        # 6) Attempt to remove the file from disk (best-effort)
-        try:
-            fp = getattr(upload, "storage_path", None)
-            if fp and os.path.exists(fp):
-                os.remove(fp)
-                logger.info("Removed upload file from disk: %s", fp)
-        except Exception:
-            logger.exception("Failed to remove upload file from disk for upload %s", upload_id)
-
-        # 7) Delete the Upload row itself
-        try:
-            db.delete(upload)
-            db.commit()
-        except IntegrityError as ie:
-            db.rollback()
-            logger.exception("IntegrityError when deleting Upload %s: %s", upload_id, ie)
-            return JSONResponse(status_code=500, content={"detail": "Database integrity error when deleting upload", "error": str(ie)})
-        except SQLAlchemyError as se:
-            db.rollback()
-            logger.exception("SQLAlchemyError when deleting Upload %s: %s", upload_id, se)
-            return JSONResponse(status_code=500, content={"detail": "Database error when deleting upload", "error": str(se)})
-
-        # Success
-        return JSONResponse(status_code=200, content={"success": True, "deleted_upload": upload_id})
+        # counted before the cascade removes the rows, for the denormalized User.log_count
+        removed = db.query(func.count(LogEntry.id)).filter(LogEntry.upload_id == upload_id).scalar() or 0
+        storage_path = upload.storage_path
+        db.delete(upload)
+        if removed:
+            db.execute(
+                update(User).where(User.email == current_user.email)
+                .values(log_count=case((User.log_count > removed, User.log_count - removed), else_=0))
+            )
+        db.commit()
+    except IntegrityError as ie:
+        db.rollback()
+        logger.exception("IntegrityError when deleting Upload %s: %s", upload_id, ie)
+        return JSONResponse(status_code=500, content={"detail": "Database integrity error when deleting upload", "error": str(ie)})
+    except SQLAlchemyError as se:
+        db.rollback()
+        logger.exception("SQLAlchemyError when deleting Upload %s: %s", upload_id, se)
+        return JSONResponse(status_code=500, content={"detail": "Database error when deleting upload", "error": str(se)})
+    _invalidate_dashboard(current_user.email)
+
+    # only after the commit, so a failed delete never loses the file
+    try:
+        if storage_path and os.path.exists(storage_path):
+            os.remove(storage_path)
+            logger.info("Removed upload file from disk: %s", storage_path)
+    except Exception:
+        logger.exception("Failed to remove upload file from disk for upload %s", upload_id)
 
-    except Exception as e:
-        # unexpected error - ensure rollback and return safe JSON
-        logger.exception("Unexpected error deleting upload %s: %s", upload_id, e)
-        try:
-            db.rollback()
-        except Exception:
-            pass
-        return JSONResponse(status_code=500, content={"detail": "Unexpected server error", "error": str(e)})
+    return JSONResponse(status_code=200, content={"success": True, "deleted_upload": upload_id})
 
 
 @router.post("/ai/analyze")
@@ -817,33 +1030,41 @@ def ai_analyze(
         progress=0
     )
     db.add(job)
+    db.flush()
+    job_id = job.id  # read before commit so the response needs no refresh SELECT
     db.commit()
-    db.refresh(job)
 
-    # Trigger background worker
-    enqueue_job(job.id)
+    # Trigger background worker (returns immediately; the job waits in _JOB_EXECUTOR's queue)
+    enqueue_job(job_id, current_user.email)
 
     # IMPORTANT: return only job_id, status, message
     return JSONResponse(
         status_code=202,
         content={
-            "job_id": job.id,
+            "job_id": job_id,
             "status": "queued",
             "message": "Analysis started in background"
         }
     )
 
-@router.post("/ai/query", response_model=AnalyzeResponse)
+# documented via responses, not response_model: the handler returns pre-encoded bytes, so
+# FastAPI never validates or re-serializes the body
+@router.post("/ai/query", responses={200: {"model": AnalyzeResponse}})
 def ai_query(payload: dict = Body(...), current_user: User = Depends(get_current_active_user)):
     text = (payload.get("text") or "").strip()
     if not text:
         raise HTTPException(status_code=400, detail="text required")
+    if len(text) > AI_QUERY_MAX_CHARS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"text too large for /ai/query (max {AI_QUERY_MAX_CHARS} chars); upload it as a log file for background analysis",
+        )
 
     suggestions = []
     graph = {"values": []}
     try:
         if AI_INTEGRATION_AVAILABLE and analyze_log_text:
-            parsed = analyze_log_text(text, filename="query.txt")
+            parsed = analyze_log_text(text, filename="query.txt", owner=current_user.email)
             if isinstance(parsed, dict):
                 probs = parsed.get("issues_found", []) or []
                 ins = parsed.get("extra_insights", []) or []
@@ -855,7 +1076,7 @@ def ai_query(payload: dict = Body(...), current_user: User = Depends(get_current
                     title = ii if isinstance(ii, str) else (ii.get("title") if isinstance(ii, dict) else str(ii))
                     suggestions.append(title)
         else:
-            if "error" in text.lower() or "exception" in text.lower():
+            if ERROR_KEYWORD_RE.search(text):
                 suggestions.append("Text includes error keywords — consider running full analysis on the related logs.")
             else:
                 suggestions.append("No obvious issues detected by lightweight analysis.")
@@ -863,7 +1084,10 @@ def ai_query(payload: dict = Body(...), current_user: User = Depends(get_current
         logging.exception("AI query failed: %s", e)
         suggestions.append("AI analysis failed (internal).")
 
-    return AnalyzeResponse(graph=graph, suggestions=suggestions)
+    # already plain JSON types: encode once (orjson when available) instead of model
+    # validation + jsonable_encoder + stdlib json
+    body = {"graph": graph, "suggestions": [s for s in suggestions if isinstance(s, str)]}
+    return Response(content=_json_dumpb(body), media_type="application/json")
 
 @router.get("/ai/analyze/result/{job_id}")
 def ai_analyze_result(job_id: int, current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
@@ -874,16 +1098,17 @@ def ai_analyze_result(job_id: int, current_user: User = Depends(get_current_acti
     # prefer reading result_path saved on job
     if getattr(job, "result_path", None):
         try:
-            with open(job.result_path, "r", encoding="utf-8") as fh:
-                data = json.load(fh)
-                return data
+            return Response(content=_read_result_bytes(job.result_path), media_type="application/json")
         except Exception:
             logging.exception("Failed to load job result from path: %s", job.result_path)
 
-    # fallback: try results dir loader
-    result = load_job_result_from_file(job_id)
-    if result:
-        return result
+    # fallback: try results dir
+    p = _result_path_for_job(job_id)
+    if os.path.exists(p):
+        try:
+            return Response(content=_read_result_bytes(p), media_type="application/json")
+        except Exception:
+            logging.exception("Failed to read job result file for job %s", job_id)
 
     # if result not ready yet
     raise HTTPException(status_code=404, detail="Result not ready")
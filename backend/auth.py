@@ -1,16 +1,24 @@
 # backend/auth.py
 import os
+import json
+import time
+import base64
+import calendar
+import hashlib
+import hmac
 import logging
 import secrets
+import threading
 from datetime import datetime, timedelta
 from typing import Optional, List
 
 from dotenv import load_dotenv
-from fastapi import APIRouter, HTTPException, Depends, status, Request
+from fastapi import APIRouter, HTTPException, Depends, status, Request, Response
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel, EmailStr
 
-from sqlalchemy.orm import Session
+from sqlalchemy import or_, case, func
+from sqlalchemy.orm import Session, load_only
 from sqlalchemy.exc import IntegrityError
 
 from passlib.context import CryptContext
@@ -41,8 +49,46 @@ except ValueError:
     TOKEN_EXPIRES = 60
 
 FRONTEND_ORIGIN_ENV = os.environ.get("FRONTEND_ORIGIN", "")
+# parsed once; the env var doesn't change while the process runs
+FRONTEND_ORIGINS: List[str] = [o.strip() for o in FRONTEND_ORIGIN_ENV.split(",") if o.strip()]
+# /auth/health body never changes, so serialize it once (probes hit this every few seconds)
+_HEALTH_BODY = json.dumps({"ok": True, "allowed_origins": FRONTEND_ORIGINS}).encode("utf-8")
+
+# in-memory caches are skipped entirely if cachetools isn't installed
+try:
+    from cachetools import TTLCache
+except ImportError:
+    TTLCache = None
+_AUTH_CACHE_LOCK = threading.Lock()
+
+# verified tokens -> claims, keyed by (kind, sha256(token)) so an access token and a Firebase ID
+# token never share an entry; an entry is also ignored once the token's own exp has passed.
+# Only signature checks are cached: the user row is read on every request.
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_TTL_SECS = 300
+_TOKEN_CACHE = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL_SECS) if TTLCache else None
+
+# recently verified (password, stored hash) pairs, so a burst of identical logins pays argon2 once
+LOGIN_CACHE_SIZE = 10000
+LOGIN_CACHE_TTL_SECS = 60
+_LOGIN_CACHE = TTLCache(maxsize=LOGIN_CACHE_SIZE, ttl=LOGIN_CACHE_TTL_SECS) if TTLCache else None
+
+# OWASP minimum argon2id profile (19 MiB, t=2, p=1); older hashes still verify and are
+# rehashed to these parameters on the next successful login
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    deprecated="auto",
+    argon2__time_cost=2,
+    argon2__memory_cost=19456,
+    argon2__parallelism=1,
+)
+# Routes are sync, so hashing already runs on FastAPI's worker threads and argon2-cffi releases
+# the GIL while hashing. Cap concurrent hashes at the core count to bound argon2's CPU and memory
+# (~19 MiB per in-flight hash) during a login storm; threads waiting here still hold their
+# threadpool slot, so this doesn't free worker threads for other requests.
+PWD_HASH_CONCURRENCY = int(os.environ.get("PWD_HASH_CONCURRENCY", str(os.cpu_count() or 2)))
+_PWD_HASH_SEMAPHORE = threading.BoundedSemaphore(PWD_HASH_CONCURRENCY)
 
-pwd_context = CryptContext(schemes=["argon2", "bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")  # note path
 
 # -------------------------
@@ -79,36 +125,128 @@ class Token(BaseModel):
 # helpers
 # -------------------------
 def get_pwd_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    with _PWD_HASH_SEMAPHORE:
+        return pwd_context.hash(password)
 
 def verify_pwd(plain_pwd: str, hashed_pwd: str) -> bool:
-    return pwd_context.verify(plain_pwd, hashed_pwd)
+    with _PWD_HASH_SEMAPHORE:
+        return pwd_context.verify(plain_pwd, hashed_pwd)
+
+def _login_cache_key(plain_pwd: str, hashed_pwd: str) -> str:
+    # keyed HMAC (never a bare fast hash of the password); includes the stored hash so a
+    # password change invalidates old entries automatically
+    msg = f"{hashed_pwd}\0{plain_pwd}".encode("utf-8")
+    return hmac.new(SECRET_KEY.encode("utf-8"), msg, hashlib.sha256).hexdigest()
+
+def verify_login_pwd(user: User, plain_pwd: str, db: Session) -> bool:
+    """verify_pwd for the login path: short-circuits repeats and upgrades outdated hashes."""
+    key = _login_cache_key(plain_pwd, user.hashed_password) if _LOGIN_CACHE is not None else None
+    if key is not None:
+        with _AUTH_CACHE_LOCK:
+            if key in _LOGIN_CACHE:
+                return True
+    with _PWD_HASH_SEMAPHORE:
+        valid, new_hash = pwd_context.verify_and_update(plain_pwd, user.hashed_password)
+    if not valid:
+        return False
+    if new_hash:
+        try:
+            user.hashed_password = new_hash
+            db.commit()
+        except Exception:
+            db.rollback()
+            logger.exception("Failed to rehash password for %s", user.email)
+    if _LOGIN_CACHE is not None:
+        with _AUTH_CACHE_LOCK:
+            _LOGIN_CACHE[_login_cache_key(plain_pwd, user.hashed_password)] = user.id
+    return True
+
+def verify_firebase_id_token(id_token: str) -> dict:
+    """
+    firebase_auth.verify_id_token with a short in-memory cache of already-verified tokens.
+    The SDK itself caches Google's signing certs (CacheControl session), so a miss is a local
+    RSA check; a hit (e.g. the client retrying the same sign-in) skips even that.
+    """
+    key = ("firebase", _token_cache_key(id_token))
+    decoded = _token_cache_get(key)
+    if decoded is not None:
+        return decoded
+    decoded = firebase_auth.verify_id_token(id_token)
+    _token_cache_put(key, decoded)
+    return decoded
+
+def _b64url(raw: bytes) -> bytes:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=")
+
+# HS* tokens: the header and the keyed HMAC state are the same for every token, so build them
+# once and only hash header.payload per call. Other algorithms go through jwt.encode.
+_HS_DIGESTS = {"HS256": hashlib.sha256, "HS384": hashlib.sha384, "HS512": hashlib.sha512}
+if ALGORITHM in _HS_DIGESTS:
+    _JWT_HEADER_B64 = _b64url(json.dumps({"alg": ALGORITHM, "typ": "JWT"}, separators=(",", ":")).encode("utf-8"))
+    _JWT_HMAC = hmac.new(SECRET_KEY.encode("utf-8"), digestmod=_HS_DIGESTS[ALGORITHM])
+else:
+    _JWT_HEADER_B64 = None
+    _JWT_HMAC = None
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta if expires_delta else timedelta(minutes=30))
-    to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    if _JWT_HMAC is None:
+        to_encode.update({"exp": expire})
+        return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    # same claim encoding jose uses: exp as integer seconds since the epoch (UTC)
+    to_encode["exp"] = calendar.timegm(expire.utctimetuple())
+    signing_input = _JWT_HEADER_B64 + b"." + _b64url(json.dumps(to_encode, separators=(",", ":")).encode("utf-8"))
+    mac = _JWT_HMAC.copy()
+    mac.update(signing_input)
+    return (signing_input + b"." + _b64url(mac.digest())).decode("ascii")
 
 def verify_token(token: str) -> str:
+    key = ("jwt", _token_cache_key(token))
+    claims = _token_cache_get(key)
+    if claims is not None:
+        return claims["sub"]
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: Optional[str] = payload.get("sub")
         if not email:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="could not verify credentials", headers={"WWW-Authenticate": "Bearer"})
+        _token_cache_put(key, payload)
         return email
-    except jwt.PyJWTError:
+    except jwt.JWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="could not verify credentials", headers={"WWW-Authenticate": "Bearer"})
 
+def _token_cache_key(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+def _token_cache_get(key: tuple) -> Optional[dict]:
+    if _TOKEN_CACHE is None:
+        return None
+    with _AUTH_CACHE_LOCK:
+        claims = _TOKEN_CACHE.get(key)
+    if claims is None or claims.get("exp", 0) <= time.time():
+        return None
+    return claims
+
+def _token_cache_put(key: tuple, claims: dict):
+    # tokens without an exp are never cached
+    if _TOKEN_CACHE is None or not claims.get("exp"):
+        return
+    with _AUTH_CACHE_LOCK:
+        _TOKEN_CACHE[key] = claims
+
 # -------------------------
 # Router
 # -------------------------
 router = APIRouter(prefix="/auth", tags=["auth"])
 
+# what request handlers read from current_user (UserResponse fields); skips hashed_password etc.
+AUTH_USER_COLUMNS = (User.id, User.name, User.email, User.role, User.organization, User.tech_stack, User.is_active)
+
 # Dependencies (use get_db from db.py)
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     email = verify_token(token)
-    user = db.query(User).filter(User.email == email).first()
+    user = db.query(User).options(load_only(*AUTH_USER_COLUMNS)).filter(User.email == email).first()
     if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User does not exist", headers={"WWW-Authenticate": "Bearer"})
     return user
@@ -120,9 +258,8 @@ def get_current_active_user(current_user: User = Depends(get_current_user)):
 
 # Health (keep under auth for convenience)
 @router.get("/health")
-def health():
-    frontend_origins: List[str] = [o.strip() for o in FRONTEND_ORIGIN_ENV.split(",") if o.strip()]
-    return {"ok": True, "allowed_origins": frontend_origins}
+async def health():
+    return Response(content=_HEALTH_BODY, media_type="application/json")
 
 # Signup
 @router.post("/signup", response_model=UserResponse, status_code=201)
@@ -146,18 +283,20 @@ def signup_user(user: UserCreate, db: Session = Depends(get_db)):
     )
     db.add(db_user)
     try:
+        # flush assigns the PK; build the response before commit expires the instance (no refresh SELECT)
+        db.flush()
+        response = UserResponse.model_validate(db_user, from_attributes=True)
         db.commit()
-        db.refresh(db_user)
     except IntegrityError:
         db.rollback()
         logger.exception("DB integrity error creating user")
         raise HTTPException(status_code=500, detail="Failed to create user (integrity error)")
-    return db_user
+    return response
 
 @router.post("/token", response_model=Token)
 def login_for_access_token(payload: LoginPayload, db: Session = Depends(get_db)):
     user = db.query(User).filter(User.email == payload.email.lower()).first()
-    if not user or not verify_pwd(payload.password, user.hashed_password):
+    if not user or not verify_login_pwd(user, payload.password, db):
         raise HTTPException(status_code=401, detail="Incorrect email or password")
 
     access_token_expires = timedelta(minutes=TOKEN_EXPIRES)
@@ -172,6 +311,36 @@ def get_profile(current_user: User = Depends(get_current_active_user)):
 def verify_token_endpoint(current_user: User = Depends(get_current_active_user)):
     return {"valid": True, "user": {"id": current_user.id, "name": current_user.name, "email": current_user.email, "role": current_user.role}}
 
+def _user_public_info(user) -> dict:
+    return {"id": user.id, "email": user.email, "name": user.name, "role": user.role}
+
+def _upsert_google_user(db: Session, values: dict) -> Optional[dict]:
+    """
+    INSERT ... ON CONFLICT (email) DO UPDATE ... RETURNING in a single round trip, so a concurrent
+    signup with the same email links the uid instead of failing. Returns None on dialects without it.
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return None
+
+    stmt = dialect_insert(User).values(**values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[User.email],
+        set_={"firebase_uid": func.coalesce(User.firebase_uid, stmt.excluded.firebase_uid)},
+    ).returning(User.id, User.email, User.name, User.role)
+    try:
+        row = db.execute(stmt).one()
+        db.commit()
+    except IntegrityError:
+        # firebase_uid already bound to another account
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Firebase account already linked to another user")
+    return dict(row._mapping)
+
 @router.post("/google-login")
 def google_login(request: Request, db: Session = Depends(get_db)):
     auth_header = request.headers.get("authorization") or request.headers.get("Authorization")
@@ -180,7 +349,7 @@ def google_login(request: Request, db: Session = Depends(get_db)):
 
     id_token = auth_header.split(" ", 1)[1].strip()
     try:
-        decoded = firebase_auth.verify_id_token(id_token)
+        decoded = verify_firebase_id_token(id_token)
     except Exception as e:
         raise HTTPException(status_code=401, detail=f"Invalid ID token: {e}")
 
@@ -191,43 +360,54 @@ def google_login(request: Request, db: Session = Depends(get_db)):
     if not email:
         raise HTTPException(status_code=400, detail="Email missing from provider token")
 
-    user = None
+    # one round trip: match on uid or email, preferring the uid match (both columns are indexed)
     if uid:
-        user = db.query(User).filter(User.firebase_uid == uid).first()
-    if not user:
+        user = (
+            db.query(User)
+            .filter(or_(User.firebase_uid == uid, User.email == email))
+            .order_by(case((User.firebase_uid == uid, 0), else_=1))
+            .first()
+        )
+    else:
         user = db.query(User).filter(User.email == email).first()
 
     if not user:
         random_pw = secrets.token_urlsafe(24)
         hashed_pw = get_pwd_hash(random_pw)
-        user = User(
+        values = dict(
             name=name or "",
             email=email,
             hashed_password=hashed_pw,
             role="user",
             organization="",
             tech_stack="",
+            is_active=True,
             is_verified=True,
             firebase_uid=uid,
             verified_at=datetime.utcnow(),
         )
-        db.add(user)
-        try:
-            db.commit()
-            db.refresh(user)
-        except IntegrityError:
-            db.rollback()
-            user = db.query(User).filter(User.email == email).first()
-            if not user:
-                raise HTTPException(status_code=500, detail="Failed to create user")
+        user_info = _upsert_google_user(db, values)
+        if user_info is None:
+            user = User(**values)
+            db.add(user)
+            try:
+                db.flush()
+                user_info = _user_public_info(user)
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+                user = db.query(User).filter(User.email == email).first()
+                if not user:
+                    raise HTTPException(status_code=500, detail="Failed to create user")
+                user_info = _user_public_info(user)
     else:
+        user_info = _user_public_info(user)
         if not user.firebase_uid and uid:
             user.firebase_uid = uid
             user.is_verified = True
             user.verified_at = datetime.utcnow()
             db.commit()
-            db.refresh(user)
 
     access_token_expires = timedelta(minutes=TOKEN_EXPIRES)
-    access_token = create_access_token(data={"sub": user.email}, expires_delta=access_token_expires)
-    return {"access_token": access_token, "token_type": "bearer", "user": {"id": user.id, "email": user.email, "name": user.name, "role": user.role}}
+    access_token = create_access_token(data={"sub": user_info["email"]}, expires_delta=access_token_expires)
+    return {"access_token": access_token, "token_type": "bearer", "user": user_info}
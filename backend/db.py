@@ -11,7 +11,8 @@ from __future__ import annotations
 import os
 from urllib.parse import urlparse, urlunparse, parse_qs, urlencode
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import NullPool
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 
@@ -63,7 +64,28 @@ engine_kwargs = {
 if DATABASE_URL.startswith("sqlite"):
     # `check_same_thread` is required for SQLite when using the same connection across threads
     engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False}, **engine_kwargs)
+
+    # SQLite leaves FK enforcement off per connection; ON DELETE CASCADE needs it on
+    @event.listens_for(engine, "connect")
+    def _enable_sqlite_foreign_keys(dbapi_conn, _record):
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+elif os.environ.get("DB_EXTERNAL_POOLER", "").lower() in ("1", "true", "yes"):
+    # PgBouncer (transaction mode) or similar in front of Postgres: let it do the pooling
+    # and open a fresh client connection per checkout to avoid double-pooling.
+    engine = create_engine(DATABASE_URL, poolclass=NullPool, **engine_kwargs)
 else:
+    # Sync routes run on FastAPI's threadpool (~40 threads) and background jobs hold their own
+    # sessions, so the default 5+10 QueuePool is too small; size it explicitly.
+    # Server-side budget: workers x (pool_size + max_overflow) must stay under Postgres max_connections.
+    engine_kwargs.update(
+        pool_size=int(os.environ.get("DB_POOL_SIZE", "20")),
+        max_overflow=int(os.environ.get("DB_MAX_OVERFLOW") or os.environ.get("DB_POOL_OVERFLOW") or "10"),
+        pool_timeout=int(os.environ.get("DB_POOL_TIMEOUT", "30")),
+        # recycle before server/proxy idle timeouts drop the connection
+        pool_recycle=int(os.environ.get("DB_POOL_RECYCLE", "1800")),
+    )
     engine = create_engine(DATABASE_URL, **engine_kwargs)
 
 # Session factory and Base
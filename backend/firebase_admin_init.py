@@ -1,6 +1,10 @@
 # firebase_admin_init.py
 import os
 import json
+import base64
+import binascii
+import functools
+import threading
 from dotenv import load_dotenv
 import firebase_admin
 from firebase_admin import credentials, auth as firebase_auth
@@ -8,31 +12,53 @@ from firebase_admin import credentials, auth as firebase_auth
 # Load environment variables from .env
 load_dotenv()
 
-def init_firebase_admin():
-    """Initialize Firebase Admin SDK using FIREBASE_SERVICE_ACCOUNT from environment."""
-    # Prevent re-initializing Firebase app if already loaded
-    if firebase_admin._apps:
-        return
+_INIT_LOCK = threading.Lock()
+
+@functools.lru_cache(maxsize=1)
+def _load_service_account_info() -> dict:
+    """
+    Parse the service account once per process.
+    FIREBASE_SERVICE_ACCOUNT_B64 (base64 of the raw JSON file) avoids newline escaping entirely;
+    FIREBASE_SERVICE_ACCOUNT (JSON string) is still supported.
+    """
+    svc_b64 = os.getenv("FIREBASE_SERVICE_ACCOUNT_B64")
+    if svc_b64:
+        return json.loads(base64.b64decode(svc_b64))
 
     # Read the service account JSON string from environment
     svc_json = os.getenv("FIREBASE_SERVICE_ACCOUNT")
     if not svc_json:
         raise RuntimeError("No Firebase credentials found in FIREBASE_SERVICE_ACCOUNT environment variable.")
 
-    try:
-        # Parse JSON string to dictionary
-        service_account_info = json.loads(svc_json)
+    # Parse JSON string to dictionary
+    service_account_info = json.loads(svc_json)
+
+    # Fix escaped newlines in private_key (common when stored in .env)
+    key = service_account_info.get("private_key")
+    if key and "\\n" in key:
+        service_account_info["private_key"] = key.replace("\\n", "\n")
+    return service_account_info
+
+def init_firebase_admin():
+    """Initialize Firebase Admin SDK using FIREBASE_SERVICE_ACCOUNT from environment."""
+    # Prevent re-initializing Firebase app if already loaded
+    if firebase_admin._apps:
+        return
 
-        # Fix escaped newlines in private_key (common when stored in .env)
-        if "private_key" in service_account_info:
-            service_account_info["private_key"] = service_account_info["private_key"].replace("\\n", "\n")
+    with _INIT_LOCK:
+        if firebase_admin._apps:
+            return
+        try:
+            service_account_info = _load_service_account_info()
 
-        # Initialize Firebase Admin SDK
-        cred = credentials.Certificate(service_account_info)
-        firebase_admin.initialize_app(cred)
-        print("✅ Firebase Admin initialized successfully")
+            # Initialize Firebase Admin SDK
+            cred = credentials.Certificate(service_account_info)
+            firebase_admin.initialize_app(cred)
+            print("✅ Firebase Admin initialized successfully")
 
-    except json.JSONDecodeError as e:
-        raise RuntimeError(f"Invalid FIREBASE_SERVICE_ACCOUNT JSON: {e}")
-    except Exception as e:
-        raise RuntimeError(f"Failed to initialize Firebase Admin: {e}")
+        except RuntimeError:
+            raise
+        except (json.JSONDecodeError, binascii.Error) as e:
+            raise RuntimeError(f"Invalid FIREBASE_SERVICE_ACCOUNT JSON: {e}")
+        except Exception as e:
+            raise RuntimeError(f"Failed to initialize Firebase Admin: {e}")
@@ -0,0 +1,72 @@
+# init_db.py
+"""
+One-shot schema setup: create missing tables, then apply migrations.run_migrations().
+
+Run once per deploy (`python init_db.py` from backend/) and start the app with
+RUN_MIGRATIONS=0, so N uvicorn workers don't each probe the schema and race on DDL.
+When it does run on startup, workers take turns under a lock (a Postgres advisory lock,
+or a file lock for SQLite): the first applies DDL, the rest wait for it and then find
+nothing left to do, so no worker serves requests before the schema is ready.
+"""
+import os
+import logging
+import tempfile
+
+from sqlalchemy import text
+
+# file lock for non-Postgres databases; not available on Windows
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from db import engine, Base
+import models  # noqa: F401  (registers tables on Base.metadata)
+from migrations import run_migrations
+
+logger = logging.getLogger("init_db")
+
+
+# app-wide key for pg_advisory_lock ("ILOG")
+SCHEMA_LOCK_KEY = 0x494C4F47
+SCHEMA_LOCK_FILE = os.environ.get("INIT_DB_LOCK_FILE") or os.path.join(tempfile.gettempdir(), "insightlogs_init.lock")
+
+
+def _create_and_migrate() -> None:
+    logger.info("Running Base.metadata.create_all(bind=engine)")
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+
+
+def init_db() -> None:
+    """Create tables and apply migrations; returns once the schema is ready.
+
+    If another process is already running setup, blocks on the schema lock until it
+    finishes, then re-runs the idempotent setup (which has nothing left to do).
+    """
+    if engine.dialect.name != "postgresql":
+        if fcntl is None:
+            _create_and_migrate()
+            return
+        with open(SCHEMA_LOCK_FILE, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                _create_and_migrate()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return
+
+    # session-level lock held on its own connection while DDL runs on others; blocks until a
+    # worker already running setup finishes, then the (idempotent) setup is a no-op here
+    with engine.connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": SCHEMA_LOCK_KEY})
+        try:
+            _create_and_migrate()
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": SCHEMA_LOCK_KEY})
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    init_db()
+    logger.info("Database schema is up to date")
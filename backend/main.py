@@ -1,22 +1,51 @@
 import os
+import json
 import logging
-from fastapi import FastAPI, Depends, Request
+import functools
+import anyio
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Tuple
 
 # load env if using dotenv
 from dotenv import load_dotenv
-load_dotenv()
+
+@functools.lru_cache(maxsize=1)
+def _load_env_once() -> Tuple[Tuple[str, ...], bool]:
+    """
+    Parse .env and resolve the CORS origins once per process. With `gunicorn --preload` this runs
+    in the master before fork and workers inherit the result.
+    """
+    load_dotenv()
+    # Accept either FRONTEND_ORIGIN or CORS_ALLOWED_ORIGINS environment variable (backwards compatible).
+    frontend_origin_env = os.environ.get("FRONTEND_ORIGIN", "").strip() or os.environ.get("CORS_ALLOWED_ORIGINS", "").strip()
+    origins = _parse_origins(frontend_origin_env)
+    # sensible fallback for local development if nothing provided
+    if not origins:
+        origins = ["https://insightlogs.onrender.com", "http://localhost:5173"]
+    # If the user explicitly set '*' we must not set allow_credentials=True
+    allow_credentials = False if origins == ["*"] else True
+    return tuple(origins), allow_credentials
+
+def _parse_origins(env_value: str) -> List[str]:
+    if not env_value:
+        return []
+    # special-case single '*' to mean allow all (no credentials)
+    if env_value == "*":
+        return ["*"]
+    parts = [p.strip().rstrip("/") for p in env_value.split(",") if p.strip()]
+    return parts
+
+_load_env_once()
 
 # DB and models
-from db import engine, Base, get_db
 # import models to ensure metadata is registered
 import models  # noqa: F401
+from init_db import init_db
 
 # routers & handlers
 from auth import router as auth_router
-from app_resources import router as resources_router
+from app_resources import router as resources_router, init_storage
 
 # import specific handler functions & pydantic models from auth to use in aliases
 from auth import (
@@ -25,44 +54,46 @@ from auth import (
     get_profile,
     verify_token_endpoint,
     google_login,
-    get_current_active_user,
-    UserCreate,
-    LoginPayload,
 )
 
+class CachedCORSMiddleware(CORSMiddleware):
+    """
+    Starlette already pre-joins the static CORS header values in __init__; what is left per request
+    is list membership on the origin/method/header allow-lists, so freeze those into sets.
+    """
+    def __init__(self, app, **kwargs):
+        super().__init__(app, **kwargs)
+        self.allow_origins = frozenset(self.allow_origins)
+        self.allow_methods = frozenset(self.allow_methods)
+        self.allow_headers = frozenset(self.allow_headers)
+
 logger = logging.getLogger("main")
 logger.setLevel(logging.INFO)
 logger.addHandler(logging.StreamHandler())
 
 # Create FastAPI app
-app = FastAPI(title="InsightLogs Backend (compat mode)")
+# orjson encodes the (already jsonable) response bodies in C; stdlib json if it isn't installed.
+# Newer FastAPI serializes response_model output itself and marks ORJSONResponse deprecated
+# (warning on every response), so only use it on versions where it isn't.
+from fastapi.responses import JSONResponse as DefaultResponse
+try:
+    import orjson  # noqa: F401
+    from fastapi.responses import ORJSONResponse
+    if not getattr(ORJSONResponse, "__deprecated__", None):
+        DefaultResponse = ORJSONResponse
+except ImportError:
+    pass
+
+app = FastAPI(title="InsightLogs Backend (compat mode)", default_response_class=DefaultResponse)
 
 # --- CORS setup (robust and safe defaults) -----------------
-# Accept either FRONTEND_ORIGIN or CORS_ALLOWED_ORIGINS environment variable (backwards compatible).
-FRONTEND_ORIGIN_ENV = os.environ.get("FRONTEND_ORIGIN", "").strip() or os.environ.get("CORS_ALLOWED_ORIGINS", "").strip()
-
-def _parse_origins(env_value: str) -> List[str]:
-    if not env_value:
-        return []
-    # special-case single '*' to mean allow all (no credentials)
-    if env_value == "*":
-        return ["*"]
-    parts = [p.strip().rstrip("/") for p in env_value.split(",") if p.strip()]
-    return parts
-
-origins = _parse_origins(FRONTEND_ORIGIN_ENV)
-# sensible fallback for local development if nothing provided
-if not origins:
-    origins = ["https://insightlogs.onrender.com", "http://localhost:5173"]
-
-# If the user explicitly set '*' we must not set allow_credentials=True
-allow_credentials = False if origins == ["*"] else True
+origins, allow_credentials = _load_env_once()
 
 logger.info("CORS origins: %s (allow_credentials=%s)", origins, allow_credentials)
 
 app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
+    CachedCORSMiddleware,
+    allow_origins=list(origins),
     allow_credentials=allow_credentials,
     allow_methods=["*"],
     allow_headers=["*"],
@@ -78,64 +109,49 @@ app.include_router(resources_router, prefix="")
 # be surprising on some deployments, so we perform it on the startup event instead.
 @app.on_event("startup")
 def on_startup():
+    # sync routes run on anyio's default threadpool (40 threads); let deploys size it to the DB pool
+    threadpool_size = os.environ.get("THREADPOOL_SIZE")
+    if threadpool_size:
+        anyio.to_thread.current_default_thread_limiter().total_tokens = int(threadpool_size)
+    # schema setup is on by default for single-process/dev runs; multi-worker deploys should
+    # run `python init_db.py` once and set RUN_MIGRATIONS=0
+    if os.environ.get("RUN_MIGRATIONS", "1").lower() not in ("0", "false", "no"):
+        try:
+            init_db()
+        except Exception as e:
+            logger.exception("Failed to initialize DB schema on startup: %s", e)
     try:
-        logger.info("Running Base.metadata.create_all(bind=engine)")
-        Base.metadata.create_all(bind=engine)
+        init_storage()
     except Exception as e:
-        logger.exception("Failed to create DB tables on startup: %s", e)
+        logger.exception("Failed to create upload storage directories: %s", e)
 
 
+# constant bodies, serialized once (load balancer probes hit these every few seconds)
+_ROOT_BODY = json.dumps({"ok": True, "message": "InsightLogs backend running"}).encode("utf-8")
+_HEALTH_BODY = json.dumps({"status": "ok"}).encode("utf-8")
+
 @app.get("/")
-def root():
-    return {"ok": True, "message": "InsightLogs backend running"}
+async def root():
+    return Response(content=_ROOT_BODY, media_type="application/json")
 
 # Health endpoint (useful for Render and load balancers)
 @app.get("/health")
-def health():
-    return {"status": "ok"}
+async def health():
+    return Response(content=_HEALTH_BODY, media_type="application/json")
 
 
 
-# 1) /signup  -> calls auth.signup_user
-@app.post("/signup", tags=["compat"])
-def signup_compat(user: UserCreate, db: Session = Depends(get_db)):
-    """
-    Compatibility endpoint: calls auth.signup_user
-    """
-    return signup_user(user=user, db=db)
-
-# 2) /token -> calls auth.login_for_access_token
-@app.post("/token", tags=["compat"])
-def token_compat(payload: LoginPayload, db: Session = Depends(get_db)):
-    """
-    Compatibility endpoint: calls auth.login_for_access_token
-    """
-    return login_for_access_token(payload=payload, db=db)
-
-# 2b) /api/auth/token -> same as above (some frontends use this path)
-@app.post("/api/auth/token", tags=["compat"])
-def token_compat_api(payload: LoginPayload, db: Session = Depends(get_db)):
-    return login_for_access_token(payload=payload, db=db)
-
-# 3) /profile -> calls auth.get_profile (depends on auth.get_current_active_user)
-@app.get("/profile", tags=["compat"])
-def profile_compat(current_user = Depends(get_current_active_user)):
-    """
-    Compatibility endpoint: calls auth.get_profile
-    """
-    return get_profile(current_user=current_user)
-
-# 4) /verify-token -> calls auth.verify_token_endpoint
-@app.get("/verify-token", tags=["compat"])
-def verify_token_compat(current_user = Depends(get_current_active_user)):
-    return verify_token_endpoint(current_user=current_user)
-
-# 5) /api/auth/google-login -> calls auth.google_login
-@app.post("/api/auth/google-login", tags=["compat"])
-def google_login_compat(request: Request, db: Session = Depends(get_db)):
-    """
-    Compatibility endpoint: calls auth.google_login
-    """
-    
-    return google_login(request=request, db=db)
+# Compatibility routes: the auth handlers mounted again at the paths older frontends call.
+# Registered directly (no wrapper functions), so FastAPI resolves each handler's own dependencies.
+COMPAT_ROUTES = (
+    ("/signup", signup_user, ["POST"]),
+    ("/token", login_for_access_token, ["POST"]),
+    # some frontends use this path
+    ("/api/auth/token", login_for_access_token, ["POST"]),
+    ("/profile", get_profile, ["GET"]),
+    ("/verify-token", verify_token_endpoint, ["GET"]),
+    ("/api/auth/google-login", google_login, ["POST"]),
+)
 
+for path, endpoint, methods in COMPAT_ROUTES:
+    app.add_api_route(path, endpoint, methods=methods, tags=["compat"])
@@ -0,0 +1,216 @@
+# migrations.py
+"""
+Small, idempotent schema upgrades run at startup.
+
+Base.metadata.create_all() only creates missing tables; it never adds columns or
+indexes to a table that already exists. Every step below inspects the live schema
+first, so run_migrations() is safe to call on each boot for fresh and old databases.
+"""
+import logging
+from sqlalchemy import Column, MetaData, String, Table, inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError
+
+from db import Base
+from models import JOB_STATUSES
+
+logger = logging.getLogger("migrations")
+
+
+# names of one-shot data migrations that have completed; schema steps inspect the live schema instead
+_MIGRATION_LOG = Table("schema_migrations", MetaData(), Column("name", String(100), primary_key=True))
+
+
+def _already_applied(conn: Connection, name: str) -> bool:
+    _MIGRATION_LOG.create(bind=conn, checkfirst=True)
+    return conn.execute(_MIGRATION_LOG.select().where(_MIGRATION_LOG.c.name == name)).first() is not None
+
+
+def _mark_applied(conn: Connection, name: str) -> None:
+    conn.execute(_MIGRATION_LOG.insert().values(name=name))
+
+
+def _column_names(conn: Connection, table: str) -> set:
+    return {c["name"] for c in inspect(conn).get_columns(table)}
+
+
+def _add_log_entry_is_error(conn: Connection) -> None:
+    if "is_error" in _column_names(conn, "log_entries"):
+        return
+    logger.info("Adding log_entries.is_error and backfilling existing rows")
+    conn.execute(text("ALTER TABLE log_entries ADD COLUMN is_error BOOLEAN NOT NULL DEFAULT FALSE"))
+    # same predicate the dashboard used to evaluate on every request
+    conn.execute(text(
+        "UPDATE log_entries SET is_error = TRUE "
+        "WHERE lower(trim(coalesce(level, ''))) LIKE 'err%' "
+        "OR lower(coalesce(message, '')) LIKE '%error%' "
+        "OR lower(coalesce(message, '')) LIKE '%exception%' "
+        "OR lower(coalesce(message, '')) LIKE '%traceback%'"
+    ))
+
+
+def _add_user_log_count(conn: Connection) -> None:
+    if "log_count" in _column_names(conn, "users"):
+        return
+    logger.info("Adding users.log_count and backfilling from log_entries")
+    conn.execute(text("ALTER TABLE users ADD COLUMN log_count INTEGER NOT NULL DEFAULT 0"))
+    conn.execute(text(
+        "UPDATE users SET log_count = "
+        "(SELECT count(*) FROM log_entries WHERE log_entries.user_email = users.email)"
+    ))
+
+
+def _normalize_log_entry_levels(conn: Connection) -> None:
+    # rows stored before level was trimmed + uppercased at insert; new rows are always normalized,
+    # so once this has run it never needs to scan log_entries again
+    if _already_applied(conn, "normalize_log_entry_levels"):
+        return
+    conn.execute(text(
+        "UPDATE log_entries SET level = upper(trim(level)) "
+        "WHERE level IS NOT NULL AND level <> upper(trim(level))"
+    ))
+    _mark_applied(conn, "normalize_log_entry_levels")
+
+
+def _create_missing_indexes(conn: Connection) -> None:
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=conn, checkfirst=True)
+
+
+def _add_job_status_check(conn: Connection) -> None:
+    """Postgres only: the CHECK that create_all emits for new analysis_jobs tables (SQLite can't ALTER it in)."""
+    if conn.dialect.name != "postgresql":
+        return
+    if any(c["name"] == "job_status" for c in inspect(conn).get_check_constraints("analysis_jobs")):
+        return
+    logger.info("Adding CHECK constraint job_status on analysis_jobs.status")
+    statuses = ", ".join(f"'{s}'" for s in JOB_STATUSES)
+    conn.execute(text(f"ALTER TABLE analysis_jobs ADD CONSTRAINT job_status CHECK (status IN ({statuses}))"))
+
+
+def _compress_log_entry_text_lz4(conn: Connection) -> None:
+    """
+    Postgres 14+: TOAST log_entries.raw/message with LZ4 instead of pglz (faster to compress and
+    read back). Applies to newly written values; existing rows keep pglz until rewritten.
+    """
+    if conn.dialect.name != "postgresql" or conn.dialect.server_version_info < (14,):
+        return
+    pending = conn.execute(text(
+        "SELECT attname FROM pg_attribute "
+        "WHERE attrelid = 'log_entries'::regclass AND attname IN ('raw', 'message') AND attcompression <> 'l'"
+    )).scalars().all()
+    if not pending:
+        return
+    logger.info("Setting lz4 compression on log_entries.%s", ", ".join(pending))
+    try:
+        # savepoint: servers built without lz4 reject this, which must not abort the other steps
+        with conn.begin_nested():
+            for column in pending:
+                conn.execute(text(f"ALTER TABLE log_entries ALTER COLUMN {column} SET COMPRESSION lz4"))
+    except DBAPIError:
+        logger.warning("lz4 compression is not available on this server; keeping pglz")
+
+
+_LOG_ENTRIES_RELOPTIONS = {
+    "autovacuum_vacuum_scale_factor": "0.02",
+    "autovacuum_analyze_scale_factor": "0.01",
+}
+
+
+def _tune_log_entries_autovacuum(conn: Connection) -> None:
+    """
+    Postgres only: log_entries is append-heavy and large, so the default 20% scale factors
+    let millions of dead tuples / stale stats build up between vacuums. Skipped when
+    pg_class.reloptions already has these values (ALTER TABLE takes a lock on every boot otherwise).
+    """
+    if conn.dialect.name != "postgresql":
+        return
+    current = conn.execute(text(
+        "SELECT reloptions FROM pg_class WHERE oid = 'log_entries'::regclass"
+    )).scalar() or []
+    current = dict(opt.split("=", 1) for opt in current)
+    if all(current.get(k) == v for k, v in _LOG_ENTRIES_RELOPTIONS.items()):
+        return
+    options = ", ".join(f"{k} = {v}" for k, v in _LOG_ENTRIES_RELOPTIONS.items())
+    conn.execute(text(f"ALTER TABLE log_entries SET ({options})"))
+
+
+# (table, column, referenced table.column) that should cascade when the parent row is deleted
+_CASCADE_FOREIGN_KEYS = (
+    ("analysis_jobs", "upload_id", "uploads(id)"),
+    ("log_entries", "upload_id", "uploads(id)"),
+    ("reports", "job_id", "analysis_jobs(id)"),
+)
+
+
+def _cascade_foreign_keys(conn: Connection) -> None:
+    """Postgres only: recreate pre-existing FKs with ON DELETE CASCADE (SQLite can't alter constraints)."""
+    if conn.dialect.name != "postgresql":
+        return
+    insp = inspect(conn)
+    for table, column, target in _CASCADE_FOREIGN_KEYS:
+        for fk in insp.get_foreign_keys(table):
+            if fk["constrained_columns"] != [column] or (fk.get("options") or {}).get("ondelete", "").upper() == "CASCADE":
+                continue
+            logger.info("Recreating %s.%s foreign key with ON DELETE CASCADE", table, column)
+            conn.execute(text(f'ALTER TABLE {table} DROP CONSTRAINT "{fk["name"]}"'))
+            conn.execute(text(
+                f'ALTER TABLE {table} ADD CONSTRAINT "{fk["name"]}" '
+                f"FOREIGN KEY ({column}) REFERENCES {target} ON DELETE CASCADE"
+            ))
+
+
+# single-column user_email indexes from index=True; every query is now served by a composite
+# index that leads with user_email, so these only cost write amplification
+_REDUNDANT_INDEXES = (
+    "ix_uploads_user_email",
+    "ix_analysis_jobs_user_email",
+    "ix_reports_user_email",
+    "ix_log_entries_user_email",
+)
+
+
+def _drop_redundant_indexes(conn: Connection) -> None:
+    for name in _REDUNDANT_INDEXES:
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
+# trigram indexes from the earlier LIKE-based search; superseded by search_vec below
+_OBSOLETE_INDEXES = ("ix_logentry_message_trgm", "ix_logentry_service_trgm", "ix_logentry_raw_trgm")
+
+
+def _add_log_entry_search_vec(conn: Connection) -> None:
+    """Postgres only: generated tsvector over message/service/raw for GET /logs?q=... (needs PG 12+)."""
+    if conn.dialect.name != "postgresql":
+        return
+    if "search_vec" not in _column_names(conn, "log_entries"):
+        logger.info("Adding log_entries.search_vec (generated tsvector)")
+        conn.execute(text(
+            "ALTER TABLE log_entries ADD COLUMN search_vec tsvector GENERATED ALWAYS AS ("
+            "to_tsvector('simple', coalesce(message, '') || ' ' || coalesce(service, '') || ' ' || coalesce(raw, ''))"
+            ") STORED"
+        ))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_logentry_search ON log_entries USING gin (search_vec)"))
+    for name in _OBSOLETE_INDEXES:
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
+MIGRATIONS = (
+    _add_log_entry_is_error,
+    _normalize_log_entry_levels,
+    _add_user_log_count,
+    _create_missing_indexes,
+    _drop_redundant_indexes,
+    _add_job_status_check,
+    _cascade_foreign_keys,
+    _tune_log_entries_autovacuum,
+    _compress_log_entry_text_lz4,
+    _add_log_entry_search_vec,
+)
+
+
+def run_migrations(engine: Engine) -> None:
+    with engine.begin() as conn:
+        for step in MIGRATIONS:
+            step(conn)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, Float
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, Float, Enum, Index, false, text
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from db import Base  # import the Base from db.py
@@ -16,51 +16,91 @@ class User(Base):
     is_verified = Column(Boolean, default=False)
     firebase_uid = Column(String(128), unique=True, nullable=True)
     verified_at = Column(DateTime, nullable=True)
+    # running total of this user's LogEntry rows, maintained on insert/delete (dashboard "total logs")
+    log_count = Column(Integer, nullable=False, default=0, server_default="0")
 
 class Upload(Base):
     __tablename__ = "uploads"
     id = Column(Integer, primary_key=True, index=True)
-    user_email = Column(String(150), nullable=False, index=True)
+    user_email = Column(String(150), nullable=False)
     filename = Column(String(300), nullable=False)
     storage_path = Column(String(500), nullable=False)
     size = Column(Integer, nullable=False)
     checksum = Column(String(128), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     parsed_count = Column(Integer, default=0)
+    # children are removed by ON DELETE CASCADE; the ORM doesn't load them just to delete them
+    jobs = relationship("AnalysisJob", back_populates="upload", cascade="all, delete-orphan", passive_deletes=True)
+
+    __table_args__ = (
+        # uploads list / last upload: per user, newest first
+        Index("ix_uploads_user_created", user_email, created_at.desc()),
+    )
+
+JOB_STATUSES = ("queued", "running", "done", "failed")
 
 class AnalysisJob(Base):
     __tablename__ = "analysis_jobs"
     id = Column(Integer, primary_key=True, index=True)
-    upload_id = Column(Integer, ForeignKey("uploads.id"), nullable=False, index=True)
-    user_email = Column(String(150), nullable=False, index=True)
-    status = Column(String(50), default="queued")  # queued|running|done|failed
+    upload_id = Column(Integer, ForeignKey("uploads.id", ondelete="CASCADE"), nullable=False, index=True)
+    user_email = Column(String(150), nullable=False)
+    # short VARCHAR + CHECK (non-native enum) so it stays portable to SQLite
+    status = Column(
+        Enum(*JOB_STATUSES, name="job_status", native_enum=False, create_constraint=True),
+        nullable=False,
+        default="queued",
+    )
     progress = Column(Integer, default=0)
     result_path = Column(String(500), nullable=True)
     error = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     finished_at = Column(DateTime, nullable=True)
-    upload = relationship("Upload", primaryjoin="AnalysisJob.upload_id==Upload.id")
+    upload = relationship("Upload", back_populates="jobs")
+
+    __table_args__ = (
+        # dashboard active_uploads: per user, status IN ('queued', 'running')
+        Index("ix_analysis_jobs_user_status", user_email, status),
+    )
 
 class Report(Base):
     __tablename__ = "reports"
     id = Column(Integer, primary_key=True, index=True)
-    job_id = Column(Integer, ForeignKey("analysis_jobs.id"), nullable=False)
-    user_email = Column(String(150), nullable=False, index=True)
+    job_id = Column(Integer, ForeignKey("analysis_jobs.id", ondelete="CASCADE"), nullable=False)
+    user_email = Column(String(150), nullable=False)
     title = Column(String(250), default="Analysis report")
     summary = Column(Text, nullable=True)
     artifacts_path = Column(String(500), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        # reports list / dashboard recent_reports: per user, newest first
+        Index("ix_reports_user_created", user_email, created_at.desc()),
+        # delete_upload: reports for a user's jobs
+        Index("ix_reports_user_job", user_email, job_id),
+    )
+
 
 class LogEntry(Base):
     __tablename__ = "log_entries"
     id = Column(Integer, primary_key=True, index=True)
-    user_email = Column(String(150), nullable=False, index=True)
-    upload_id = Column(Integer, ForeignKey("uploads.id"), nullable=False, index=True)
+    user_email = Column(String(150), nullable=False)
+    upload_id = Column(Integer, ForeignKey("uploads.id", ondelete="CASCADE"), nullable=False, index=True)
     timestamp = Column(DateTime, nullable=True)
     level = Column(String(50), nullable=True)
     service = Column(String(150), nullable=True)
     message = Column(Text, nullable=True)
     raw = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # set at insert time from level/message so the dashboard count is an indexed lookup
+    is_error = Column(Boolean, nullable=False, default=False, server_default=false())
     # NOTE: latency_ms column removed intentionally
+
+    __table_args__ = (
+        # partial on Postgres (only error rows are indexed); a plain composite index elsewhere
+        Index("ix_logentry_user_err", "user_email", "is_error", postgresql_where=text("is_error = true")),
+        # GET /logs: filter by user (and optionally upload), newest first, LIMIT k
+        Index("ix_logentry_user_upload_created", user_email, upload_id, created_at.desc()),
+        Index("ix_logentry_user_created", user_email, created_at.desc()),
+        # level is normalized (trim + upper) at insert, so prefix filters are plain LIKE 'ERR%'
+        Index("ix_logentry_user_level", user_email, level),
+    )